@@ -1,14 +1,40 @@
+import itertools
 import json
 import os
-import pickle
 from typing import Tuple, Dict
 
+import msgpack
 import numpy as np
 import pandas as pd
 import yaml
+from joblib import Parallel, delayed
+from numba import njit
 
 from config.path import PICKLE_DIRECTORY
 
+# the cache files are read and written through a 1 MiB buffer instead of the default 8 KiB to reduce syscalls
+CACHE_BUFFER_SIZE = 1 << 20
+
+
+# the counting kernels below fuse masking the -1 indexes, flattening and counting into one pass over the records,
+# and nogil=True lets the threads in generate_all_two_way_marginals really run them at the same time
+@njit(nogil=True, cache=True)
+def _count_one_way(codes, K):
+    counts = np.zeros(K, np.int32)
+    for k in range(codes.shape[0]):
+        if codes[k] >= 0:
+            counts[codes[k]] += 1
+    return counts
+
+
+@njit(nogil=True, cache=True)
+def _count_two_way(index_codes, column_codes, K1, K2):
+    counts = np.zeros((K1, K2), np.int32)
+    for k in range(index_codes.shape[0]):
+        if index_codes[k] >= 0 and column_codes[k] >= 0:
+            counts[index_codes[k], column_codes[k]] += 1
+    return counts
+
 
 
 class DataLoader:
@@ -36,6 +62,8 @@ class DataLoader:
 
         self.general_schema = {}
         self.filter_values = {}
+        # map each grouped attribute's name to the attributes being grouped
+        self.grouped_attrs = {}
 
         self.config = None
         # we set pub_ref=False since the default case is not owning a public dataset to refer to
@@ -48,8 +76,10 @@ class DataLoader:
         # CONFIG_DATA means data.yaml, which include some paths and value bins
         from experiment import PRIV_DATA, CONFIG_DATA, PARAMS, PRIV_DATA_NAME, DATA_TYPE
         with open(CONFIG_DATA, 'r', encoding="utf-8") as f:
-            config = yaml.load(f, Loader=yaml.FullLoader)
+            config = yaml.load(f, Loader=yaml.CSafeLoader)
         self.config = config
+        self.grouped_attrs = {grouping['grouped_name']: grouping['attributes']
+                              for grouping in config['grouping_attributes']}
         print("------------------------> config yaml file loaded in DataLoader, config file: ", CONFIG_DATA)
 
      
@@ -59,46 +89,109 @@ class DataLoader:
             self.general_schema = parameter_spec['schema']
         print("------------------------> parameter file loaded in DataLoader, parameter file: ", PARAMS)
 
-        # we use pickle to store the objects in files as binary flow
-        priv_pickle_path = PICKLE_DIRECTORY / f"preprocessed_priv_{PRIV_DATA_NAME}.pkl"
-
         # load private data
-        if os.path.isfile(priv_pickle_path) and not pub_only:
-            print("********** load private data from pickle **************")
-            print("------------------------> priv pickle path: ", priv_pickle_path)
-            [self.private_data, self.encode_mapping] = pickle.load(open(priv_pickle_path, 'rb'))
-            for attr, encode_mapping in self.encode_mapping.items():
-                self.decode_mapping[attr] = sorted(encode_mapping, key=encode_mapping.get)
-        
-        elif not pub_only:
-            print("************* start loading private data *************")
-            print("------------------------> process and store with pkl file name: ", f"preprocessed_priv_{PRIV_DATA_NAME}.pkl")
-            from experiment import DATA_TYPE
-
-            with open(DATA_TYPE,'r', encoding="utf-8") as f:
-                content = json.load(f)
-            COLS = content['dtype']
-
-            self.private_data = pd.read_csv(PRIV_DATA, dtype=COLS)
-            print(self.private_data)
-
-            self.private_data.fillna('',inplace=True)
-            print("********** afer fillna ***********")
-            print(self.private_data)
-            print("------------------------> private dataset: ", PRIV_DATA)
-            self.private_data = self.binning_attributes(config['numerical_binning'], self.private_data)
-            # self.private_data = self.grouping_attributes(config['grouping_attributes'], self.private_data)
-            self.private_data = self.remove_identifier(self.private_data)
-            # self.private_data = self.remove_determined_attributes(config['determined_attributes'], self.private_data)
-            self.private_data = self.encode_remain(self.general_schema, config, self.private_data, is_private=True)
-            pickle.dump([self.private_data, self.encode_mapping], open(priv_pickle_path, 'wb'))
+        if not pub_only:
+            self.private_data = self.preprocess(PRIV_DATA, f"preprocessed_priv_{PRIV_DATA_NAME}", is_private=True)
 
+        # once all the data are encoded, we derive the decode mapping and schema from the encode mapping,
+        # every encoding assigns the indexes 0,...,K-1 in insertion order, so the keys are already in decode order
         for attr, encode_mapping in self.encode_mapping.items():
-        # note that here schema means all the valid values of encoded ones
-            self.encode_schema[attr] = sorted(encode_mapping.values())
+            self.decode_mapping[attr] = list(encode_mapping.keys())
+            # note that here schema means all the valid values of encoded ones
+            self.encode_schema[attr] = list(range(len(encode_mapping)))
         print("************* private data loaded and preprocessed in DataLoader ************")
         print("priv df's rows:------------------------> ", self.private_data.shape[0])
 
+    def preprocess(self, csv_path, cache_name, is_private=False):
+        """load the dataset in csv_path and run the whole preprocessing pipeline on it,
+        then store the preprocessed DataFrame and the encode mapping in PICKLE_DIRECTORY under cache_name,
+        if they are already stored, we simply reload them instead
+
+        """
+        # we store the encoded records as one column-major .npy array and the columns and encode mapping
+        # as a msgpack sidecar, neither of them can execute code on loading as pickle does.
+        # the array is memory-mapped on reload, so its pages are only read from disk when the marginals scan them
+        records_path = PICKLE_DIRECTORY / f"{cache_name}.npy"
+        meta_path = PICKLE_DIRECTORY / f"{cache_name}.msgpack"
+
+        if os.path.isfile(records_path) and os.path.isfile(meta_path):
+            print("********** load data from memory-mapped npy **************")
+            print("------------------------> npy path: ", records_path)
+            meta = self.load_msgpack(meta_path)
+            # mmap_mode='c' is copy-on-write, writing to the DataFrame never touches the cache file
+            records = np.load(records_path, mmap_mode='c')
+            data = pd.DataFrame(records, columns=list(meta['columns']), copy=False)
+            self.encode_mapping.update(meta['encode_mapping'])
+            return data
+
+        print("************* start loading data *************")
+        print("------------------------> process and store with npy file name: ", f"{cache_name}.npy")
+        from experiment import DATA_TYPE
+
+        with open(DATA_TYPE,'r', encoding="utf-8") as f:
+            content = json.load(f)
+        COLS = content['dtype']
+        # the valid values of categorical attributes are known from the schema,
+        # so we let the csv parser encode them as categories directly
+        cat_dtypes = {attr: pd.CategoricalDtype(spec['values'])
+                      for attr, spec in self.general_schema.items()
+                      if attr not in self.config['numerical_binning'] and 'values' in spec}
+
+        data = pd.read_csv(csv_path, dtype={**COLS, **cat_dtypes})
+        print(data)
+
+        # a categorical column can only be filled with '' if '' is one of its valid values,
+        # otherwise the missing values stay NaN and are encoded as -1 in encode_remain
+        for attr in data.columns:
+            if attr not in cat_dtypes or '' in cat_dtypes[attr].categories:
+                data[attr] = data[attr].fillna('')
+        print("********** afer fillna ***********")
+        print(data)
+        print("------------------------> dataset: ", csv_path)
+        data = self.binning_attributes(self.config['numerical_binning'], data)
+        # data = self.grouping_attributes(self.config['grouping_attributes'], data)
+        data = self.remove_identifier(data)
+        # data = self.remove_determined_attributes(self.config['determined_attributes'], data)
+        data = self.encode_remain(self.general_schema, self.config, data, is_private=is_private)
+
+        os.makedirs(PICKLE_DIRECTORY, exist_ok=True)
+        # all the attributes are encoded to integers by now, so the records share one (narrow) integer type
+        with open(records_path, 'wb', buffering=CACHE_BUFFER_SIZE) as f:
+            np.save(f, np.asfortranarray(data.to_numpy()), allow_pickle=False)
+        # the encode mapping may also hold other datasets' attributes, we only store this dataset's part
+        self.dump_msgpack({'columns': list(data.columns),
+                           'encode_mapping': {attr: self.encode_mapping[attr] for attr in data.columns}}, meta_path)
+        return data
+
+    @staticmethod
+    def dump_msgpack(obj, path):
+        """store obj (e.g. the encode mapping) in msgpack format
+        the keys of binned attributes are interval tuples, which msgpack packs as arrays
+
+        """
+        with open(path, 'wb', buffering=CACHE_BUFFER_SIZE) as f:
+            msgpack.pack(obj, f, use_bin_type=True)
+
+    @staticmethod
+    def load_msgpack(path):
+        """load the object stored by dump_msgpack
+        we set use_list=False so that the interval keys are recovered as (hashable) tuples
+
+        """
+        with open(path, 'rb', buffering=CACHE_BUFFER_SIZE) as f:
+            return msgpack.unpack(f, raw=False, use_list=False, strict_map_key=False)
+
+    @staticmethod
+    def encode_dtype(num_values):
+        """return the narrowest signed integer type holding the indexes 0,...,num_values-1 and -1,
+        the encoded attributes rarely have more than 127 values so they mostly fit in int8
+
+        """
+        if num_values <= np.iinfo(np.int8).max:
+            return np.int8
+        if num_values <= np.iinfo(np.int16).max:
+            return np.int16
+        return np.int32
 
     def obtain_attrs(self):
         """return the list of all attributes' name  except the identifier attribute
@@ -130,13 +223,13 @@ class DataLoader:
             # generate the bins
             # use np.arrange(s,t,step) to generate 1-dim array
             bins = np.r_[-np.inf, np.arange(s, t, step), np.inf]    
-            # translate attribute original value to intervals and further translate to interval codes 
-            data[attr] = pd.cut(data[attr], bins).cat.codes    
-            # actually, the following 2 rows are based on agreed convention and serve not hard use
-            # range(n) return [0,..,n-1]
+            # translate attribute original value directly to interval codes, labels=False skips building the intervals,
+            # missing values get NaN which we encode as -1 like the other attributes
+            codes = pd.cut(data[attr], bins, labels=False)
+            data[attr] = codes.fillna(-1).astype(self.encode_dtype(len(bins) - 1))
+            # actually, the following row is based on agreed convention and serves not hard use,
+            # the decode mapping is derived from it in load_data
             self.encode_mapping[attr] = {(bins[i], bins[i + 1]): i for i in range(len(bins) - 1)}
-            # actually, the decode_maping is naive? just record the index array should suffice? I doubt...
-            self.decode_mapping[attr] = [i for i in range(len(bins) - 1)]
         print("binning attributes done in DataLoader")
         return data
 
@@ -145,32 +238,49 @@ class DataLoader:
 
         """
         print("************* start grouping some attributes **************")
+        grouped_attrs = []
         for grouping in grouping_info:
             attributes = grouping['attributes']
             new_attr = grouping['grouped_name']
 
-            # group attribute values into tuples
-            data[new_attr] = data[attributes].apply(tuple, axis=1)
-
-            # map tuples to new values in new columns
-            encoding = {v: i for i, v in enumerate(grouping['combinations'])}
-            # this row is verbous, data[new_attr] = data[attributes].apply(tuple, axis=1)
-            # here we map them to codes again like we map intervals to interval indexes
-            data[new_attr] = data[new_attr].map(encoding)
-           
+            # the safe yaml loader reads each combination as a list, we turn them to (hashable) tuples
+            combinations = [tuple(combination) for combination in grouping['combinations']]
+
+            # instead of grouping attribute values into tuples row by row,
+            # we index each attribute's values among those appearing in the combinations
+            # and fold the indexes into one integer key, like digits of a mixed radix number
+            combination_keys = np.zeros(len(combinations), dtype=np.int64)
+            record_keys = np.zeros(len(data), dtype=np.int64)
+            valid = np.ones(len(data), dtype=bool)
+            for k, attr in enumerate(attributes):
+                values = [combination[k] for combination in combinations]
+                levels = pd.Index(values).unique()
+                combination_keys = combination_keys * len(levels) + levels.get_indexer(values)
+                record_index = levels.get_indexer(data[attr])
+                valid &= record_index >= 0
+                record_keys = record_keys * len(levels) + record_index
+
+            # here we map the keys to the combinations' indexes like we map intervals to interval indexes,
+            # records whose tuple is not among the combinations are encoded as -1
+            order = np.argsort(combination_keys)
+            sorted_keys = combination_keys[order]
+            position = np.searchsorted(sorted_keys, record_keys).clip(max=len(sorted_keys) - 1)
+            valid &= sorted_keys[position] == record_keys
+            data[new_attr] = np.where(valid, order[position], -1).astype(self.encode_dtype(len(combinations)))
+
+            encoding = {v: i for i, v in enumerate(combinations)}
             self.encode_mapping[new_attr] = encoding
-            # look at this, here decode_mapping is a dict which maps index to real tuple
-            self.decode_mapping[new_attr] = grouping['combinations']
 
             # todo: do we still need filter?
             # EMP top 20 filter
             # if "filter" in grouping:
             #     data = data[~data[new_attr].isin(self.filter_values[new_attr])]
 
-            # drop those already included in new_attr
-            data = data.drop(attributes, axis=1)
+            # remember those already included in new_attr, we drop them all at once after the loop
+            grouped_attrs.extend(attributes)
             print("new attr:", new_attr, "<-", attributes)
             print("new uniques after encoding:", sorted(data[new_attr].unique()))
+        data = data.drop(columns=grouped_attrs)
         # display after grouping
         print("columns after grouping:", data.columns)
         print("grouping attributes done in DataLoader")
@@ -194,9 +304,9 @@ class DataLoader:
         so why not first desert them and finally recover them 
 
         """
+        # desert the determined attributes in one drop and print the info
+        data = data.drop(columns=list(determined_info.keys()))
         for determined_attr in determined_info.keys():
-            data = data.drop(determined_attr, axis=1)
-        # desert the determined attributes and print the info
             print("remove", determined_attr)
         # desert the identifiers, but wait(why it seems to have appeared otherwhere?)
         # data = data.drop(self.config[identifier], axis=1) 
@@ -221,9 +331,12 @@ class DataLoader:
             mapping = schema[attr]['values']
             encoding = {v: i for i, v in enumerate(mapping)}
             # we encode the remaining single attributes' original values to the categorical indexes
-            data[attr] = data[attr].map(encoding)
+            # columns read as categorical already hold the indexes as codes (-1 for values out of schema)
+            if isinstance(data[attr].dtype, pd.CategoricalDtype):
+                data[attr] = data[attr].cat.codes.astype(self.encode_dtype(len(encoding)))
+            else:
+                data[attr] = data[attr].map(encoding).fillna(-1).astype(self.encode_dtype(len(encoding)))
             self.encode_mapping[attr] = encoding
-            self.decode_mapping[attr] = mapping
         print("encoding remaining single attributes done in DataLoader")
         return data
    
@@ -231,41 +344,44 @@ class DataLoader:
         """ generate marginal for one attribute
         (I guess the recommended arg should be in type of str)
 
-        we first assign a new column 'n' and assign them as 1 for each record in orignal DataFrame
-        note that aggfunc means aggrigation function 
-        and we get counts for each candidate value for the specific index_attribute
-        we set fill_value=0 for NaN
+        since the attribute is encoded to indexes 0,...,K-1,
+        we count each candidate value into an array of length K which gives the full ascending index directly,
+        records encoded as -1 (values out of schema) are not counted
         
         """
-        marginal = records.assign(n=1).pivot_table(values='n', index=index_attribute, aggfunc=np.sum, fill_value=0)
-        # we create new indices which is in ascending order to help create a user-friendly pivot table
-        indices = sorted([i for i in self.encode_mapping[index_attribute].values()])
-        # and we reindex then fillna(0) means we will fill NaN with 0
-        marginal = marginal.reindex(index=indices).fillna(0).astype(np.int32)
-        return marginal
+        K = len(self.encode_mapping[index_attribute])
+        counts = _count_one_way(records[index_attribute].to_numpy(), K)
+        return pd.DataFrame(counts, index=pd.RangeIndex(K, name=index_attribute), columns=['n'])
 
     def generate_two_way_marginal(self, records: pd.DataFrame, index_attribute: list, column_attribute: list):
         """generate marginal for a pair of attributes
 
         index_attribute corresponds to row index
         column_attribute corresponds to column index 
+        we count the pair of indexes directly into the K1*K2 grid
         
         """
-        marginal = records.assign(n=1).pivot_table(values='n', index=index_attribute, columns=column_attribute,
-                                                   aggfunc=np.sum, fill_value=0)
-        # create a new ordered indices for row and column, just serving for a new display order
-        indices = sorted([i for i in self.encode_mapping[index_attribute].values()])
-        columns = sorted([i for i in self.encode_mapping[column_attribute].values()])
-        marginal = marginal.reindex(index=indices, columns=columns).fillna(0).astype(np.int32)
+        K1 = len(self.encode_mapping[index_attribute])
+        K2 = len(self.encode_mapping[column_attribute])
+        counts = self.count_two_way(records[index_attribute].to_numpy(),
+                                    records[column_attribute].to_numpy(), K1, K2)
+        marginal = pd.DataFrame(counts, index=pd.RangeIndex(K1, name=index_attribute),
+                                columns=pd.RangeIndex(K2, name=column_attribute))
        
         # print("*********** generating a two-way marginal *********** ")
-        # print("*********** i ******* ", indices)
-        # print("*********** j ******* ", columns)
         # print(marginal)
         # print("********** tmp count from the two-way marginal ****** ", np.sum(marginal.values))
 
         return marginal
 
+    @staticmethod
+    def count_two_way(index_codes: np.ndarray, column_codes: np.ndarray, K1: int, K2: int):
+        """count the pairs of encoded indexes on a K1*K2 grid,
+        pairs where either index is -1 (values out of schema) are not counted
+
+        """
+        return _count_two_way(index_codes, column_codes, K1, K2)
+
     
     def generate_all_one_way_marginals(self, records: pd.DataFrame):
         """generate all the one-way marginals,
@@ -281,14 +397,31 @@ class DataLoader:
     
     def generate_all_two_way_marginals(self, records: pd.DataFrame):
         """generate all the two-way marginals,
-        which simply builds a loop and calls generate_two_way_marginal in every cycle round
+        which counts every pair of attributes like generate_two_way_marginal,
+        except that the encoded records are converted to a NumPy array only once
+        and the columns are indexed by offset for each pair.
+        The pairs are independent of each other, so we count them in a pool of threads
+        which share the read-only array without copying it
         
         """
         all_attrs = self.obtain_attrs()
+        domains = [len(self.encode_mapping[attr]) for attr in all_attrs]
+        # column-major so that every codes[:, i] is a contiguous column,
+        # and the array keeps the narrow integer type the attributes are encoded in.
+        # when the records hold exactly all_attrs (e.g. reloaded from the memory-mapped cache),
+        # we skip the column selection which would copy them
+        if list(records.columns) != all_attrs:
+            records = records[all_attrs]
+        codes = np.asfortranarray(records.to_numpy())
+        pairs = list(itertools.combinations(range(len(all_attrs)), 2))
+        all_counts = Parallel(n_jobs=-1, backend='threading', batch_size=16)(
+            delayed(self.count_two_way)(codes[:, i], codes[:, j], domains[i], domains[j]) for i, j in pairs)
+
         marginals = {}
-        for i, attr in enumerate(all_attrs):
-            for j in range(i + 1, len(all_attrs)):
-                marginals[frozenset([attr, all_attrs[j]])] = self.generate_two_way_marginal(records, attr, all_attrs[j])
+        for (i, j), counts in zip(pairs, all_counts):
+            marginals[frozenset([all_attrs[i], all_attrs[j]])] = pd.DataFrame(
+                counts, index=pd.RangeIndex(domains[i], name=all_attrs[i]),
+                columns=pd.RangeIndex(domains[j], name=all_attrs[j]))
         
         print("------------------------> all two way marginals generated")
         # debug
@@ -343,17 +476,7 @@ class DataLoader:
         otherwise the list includes the attributes being grouped.
 
         """
-        info = {}
-        grouping_info = self.config['grouping_attributes']
-        for attr in cur_attrs:
-            for grouping in grouping_info:
-                new_attr = grouping['grouped_name']
-                if new_attr == attr:
-                    info[new_attr] = grouping['attributes']
-                    break
-            if attr not in info:
-                info[attr] = [attr]
-        return info
+        return {attr: self.grouped_attrs.get(attr, [attr]) for attr in cur_attrs}
 
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@ class RecordPostprocessor:
     def post_process(self, data: pd.DataFrame, config_file_path: str, grouping_mapping: dict):
         assert isinstance(data, pd.DataFrame)
         with open(config_file_path, 'r', encoding="utf-8") as f:
-            self.config = yaml.load(f, Loader=yaml.BaseLoader)
+            self.config = yaml.load(f, Loader=yaml.CSafeLoader)
         # add for debug
         # print(data)
         # print(grouping_mapping)
@@ -44,8 +44,8 @@ parser.add_argument("--update_iterations", type=int, default=30,
                    help="specify the num of update iterations")
 
 # target path of synthetic dataset
-parser.add_argument("--target_path", type=str, default="out.csv",
-help="specify the target path of the synthetic dataset")
+parser.add_argument("--target_path", type=str, default="out.parquet",
+help="specify the target path of the synthetic dataset, written in csv format if it ends with .csv and in parquet format otherwise")
 
 
 args = parser.parse_args()
@@ -64,10 +64,12 @@ from method.dpsyn import DPSyn
 
 
 def main():
+    # the seeded generator is passed to the synthesizers for all their random draws,
+    # we still seed the legacy global state for any code relying on np.random directly
+    rng = np.random.default_rng(0)
     np.random.seed(0)
-    np.random.RandomState(0)
     with open(args.config, 'r', encoding="utf-8") as f:
-        config = yaml.load(f, Loader=yaml.BaseLoader)
+        config = yaml.load(f, Loader=yaml.CSafeLoader)
 
     # dataloader initialization
     dataloader = DataLoader()
@@ -80,19 +82,22 @@ def main():
     priv_data = args.priv_data
     priv_data_name = args.priv_data_name
    
-    syn_data = run_method(config, dataloader, n)
+    syn_data = run_method(config, dataloader, n, rng)
     # if users set the records' num, we denote it in synthetic dataset's name
     if n!=0:
         print("------------------------> now we synthesize a dataset with ", n, "rows")
+    # parquet is written column by column in binary, which is much faster than formatting every cell for csv,
+    # we still write csv when the target path asks for it, e.g. for downstream tools that only read csv
+    if Path(TARGET_PATH).suffix == '.csv':
         syn_data.to_csv(Path(TARGET_PATH), index=False)
-    # the default synthetic dataset name when n=0 
     else:
-        syn_data.to_csv(Path(TARGET_PATH), index=False)
+        syn_data.to_parquet(Path(TARGET_PATH), engine='pyarrow', compression='zstd', index=False)
 
 
-def run_method(config, dataloader, n):
+def run_method(config, dataloader, n, rng=None):
     parameters = json.loads(Path(args.params).read_text())
-    syn_data = None
+    # we collect the synthesized DataFrame of every run and concatenate them once after the loop
+    syn_parts = []
 
     # each item in 'runs' specify one dp task with (eps, delta, sensitivity) 
     # as well as a possible 'max_records' value which bounds the dataset's size
@@ -140,7 +145,7 @@ def run_method(config, dataloader, n):
 
 
         """
-        synthesizer = DPSyn(dataloader, eps, delta, sensitivity)
+        synthesizer = DPSyn(dataloader, eps, delta, sensitivity, rng=rng)
         # tmp returns a DataFrame
         tmp = synthesizer.synthesize(fixed_n=n)
         
@@ -148,12 +153,10 @@ def run_method(config, dataloader, n):
         # so when do comparison, you should remove this column for consistence
         tmp['epsilon'] = eps
 
-        # syn_data is a list, tmp is added in the list 
-        if syn_data is None:
-            syn_data = tmp
-        else:
-            syn_data = syn_data.append(tmp, ignore_index=True)
+        # syn_parts is a list, tmp is added in the list 
+        syn_parts.append(tmp)
 
+    syn_data = pd.concat(syn_parts, ignore_index=True)
 
     # post-processing generated data, map records with grouped/binned attribute back to original attributes
     print("********************* START POSTPROCESSING ***********************")
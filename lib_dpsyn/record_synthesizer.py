@@ -29,10 +29,12 @@ class RecordSynthesizer:
     encode_records = None
     encode_records_sort_index = None
 
-    def __init__(self, attrs, domains, num_records):
+    def __init__(self, attrs, domains, num_records, rng: np.random.Generator = None):
         self.attrs = attrs
         self.domains = domains
         self.num_records = num_records
+        # all the random draws go through one seeded generator, an unseeded one is created if not given
+        self.rng = rng if rng is not None else np.random.default_rng()
 
 # TODO: later take a look at values related to alpha beta magic values 
     def update_alpha(self, iteration):
@@ -64,7 +66,7 @@ class RecordSynthesizer:
 
         for attr_i, attr in enumerate(self.attrs):
             if method == "random":
-                self.records[:, attr_i] = np.random.randint(0, self.domains[attr_i], size=self.num_records)
+                self.records[:, attr_i] = self.rng.integers(0, self.domains[attr_i], size=self.num_records)
 
             elif method == "singleton":
                 self.records[:, attr_i] = self.generate_singleton_records(singleton_views[attr])
@@ -82,7 +84,7 @@ class RecordSynthesizer:
             record[start: end] = index
             start = end
 
-        np.random.shuffle(record)
+        self.rng.shuffle(record)
 
         return record
 
@@ -130,12 +132,12 @@ class RecordSynthesizer:
 
         for i, cell_index in enumerate(valid_cell_over_indices):
             match_records_indices = self.encode_records_sort_index[valid_data_over_index_left[i]: valid_data_over_index_right[i]]
-            throw_indices = np.random.choice(match_records_indices, valid_cell_num_reduce[i], replace=False)
+            throw_indices = self.rng.choice(match_records_indices, valid_cell_num_reduce[i], replace=False)
 
             self.records_throw_indices[throw_pointer: throw_pointer + throw_indices.size] = throw_indices
             throw_pointer += throw_indices.size
 
-        np.random.shuffle(self.records_throw_indices)
+        self.rng.shuffle(self.records_throw_indices)
 
     def handle_zero_cells(self, view):
         # overwrite / partial when synthesize_marginal == 0
@@ -165,7 +167,7 @@ class RecordSynthesizer:
         for valid_index, cell_index in enumerate(valid_cell_under_indices):
             match_records_indices = self.encode_records_sort_index[valid_data_under_index_left[valid_index]: valid_data_under_index_right[valid_index]]
 
-            np.random.shuffle(match_records_indices)
+            self.rng.shuffle(match_records_indices)
             
             if self.records_throw_indices.shape[0] >= (num_complete[valid_index] + num_partial[valid_index]):
                 # complete update code
@@ -232,7 +234,7 @@ class RecordSynthesizer:
         if self.rounding_method == 'stochastic':
             # avoid bias 
             ret_vector = np.zeros(vector.size)
-            rand = np.random.rand(vector.size)
+            rand = self.rng.random(vector.size)
 
             integer = np.floor(vector)
             decimal = vector - integer
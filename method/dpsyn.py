@@ -119,7 +119,7 @@ class DPSyn(Synthesizer):
         """
         from experiment import MARGINAL_CONFIG
         with open(MARGINAL_CONFIG, 'r', encoding="utf-8") as f:
-            priv_marginal_config = yaml.load(f, Loader=yaml.FullLoader)
+            priv_marginal_config = yaml.load(f, Loader=yaml.CSafeLoader)
         priv_split_method = {} 
 
         noisy_marginals, num_records = self.obtain_consistent_marginals(priv_marginal_config, priv_split_method)
@@ -160,7 +160,7 @@ class DPSyn(Synthesizer):
                 if len(cur_attrs) == 1:
                     singleton_views[cur_attrs] = view
 
-            synthesizer = RecordSynthesizer(attrs, domains, num_synthesize_records)
+            synthesizer = RecordSynthesizer(attrs, domains, num_synthesize_records, rng=self.rng)
             synthesizer.initialize_records(list_marginal_attrs, singleton_views=singleton_views)
             attrs_index_map = {attrs: index for index, attrs in enumerate(list_marginal_attrs)}
 
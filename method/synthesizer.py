@@ -20,11 +20,13 @@ class Synthesizer(object):
     __metaclass__ = abc.ABCMeta
     Marginals = Dict[Tuple[str], np.array]
 
-    def __init__(self, data: DataLoader, eps: float, delta: float, sensitivity: int):
+    def __init__(self, data: DataLoader, eps: float, delta: float, sensitivity: int, rng: np.random.Generator = None):
         self.data = data
         self.eps = eps
         self.delta = delta
         self.sensitivity = sensitivity
+        # the generator for the noises and the record synthesis, an unseeded one is created if not given
+        self.rng = rng if rng is not None else np.random.default_rng()
 
     @abc.abstractmethod
     def synthesize(self, fixed_n: int) -> pd.DataFrame:
@@ -68,12 +70,12 @@ class Synthesizer(object):
             if noise_type == 'lap':
                 noise_param = 1 / advanced_composition.lap_comp(eps, self.delta, self.sensitivity, len(marginals))
                 for marginal_att, marginal in marginals.items():
-                    marginal += np.random.laplace(scale=noise_param, size=marginal.shape)
+                    marginal += self.rng.laplace(scale=noise_param, size=marginal.shape)
                     noisy_marginals[marginal_att] = marginal
             else:   
                 noise_param = advanced_composition.gauss_zcdp(eps, self.delta, self.sensitivity, len(marginals))
                 for marginal_att, marginal in marginals.items():
-                    noise = np.random.normal(scale=noise_param, size=marginal.shape) 
+                    noise = self.rng.normal(scale=noise_param, size=marginal.shape) 
                     marginal += noise
                     noisy_marginals[marginal_att] = marginal 
             logger.info(f"marginal {set_key} use eps={eps}, noise type:{noise_type}, noise parameter={noise_param}, sensitivity:{self.sensitivity}")